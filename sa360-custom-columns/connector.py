@@ -1,12 +1,16 @@
 from datetime import datetime
+from functools import partial
 from fivetran_connector_sdk import Connector
 from fivetran_connector_sdk import Logging as log
 from fivetran_connector_sdk import Operations as op
 from search_ads_360 import (
+    accounts_from_cursor,
+    batch_accounts,
+    fetch_concurrently,
     get_sa360_session,
-    get_customer_clients,
-    get_custom_columns,
-    get_custom_column_data,
+    get_custom_columns_and_clients,
+    get_custom_column_data_multi,
+    reset_discovery_caches,
 )
 
 
@@ -39,139 +43,166 @@ def schema(configuration: dict):
     ]
 
 
-def get_date_diff(date_str_1, date_str_2):
-    fmt = "%Y-%m-%d"
-    d1 = datetime.strptime(date_str_1, fmt)
-    d2 = datetime.strptime(date_str_2, fmt)
-    return (d2 - d1).days
+def fetch_batch(
+    configuration,
+    session,
+    manager_id,
+    custom_columns,
+    start_date,
+    end_date,
+    resume_dates,
+    batch,
+):
+    """
+    Streams the custom column data of one batch of managed accounts up to
+    end_date, starting from the date in resume_dates for the batch's first
+    account if a previous sync stopped inside it, and from start_date otherwise.
+    """
+    date_cursor = resume_dates.get(batch[0]) or start_date
+    return get_custom_column_data_multi(
+        configuration, session, manager_id, batch, custom_columns, date_cursor, end_date
+    )
 
 
 # https://fivetran.com/docs/connectors/connector-sdk/technical-reference#update
 def update(configuration: dict, state: dict):
+    # The process may be reused across syncs; re-discover accounts and columns.
+    reset_discovery_caches()
     session = get_sa360_session(configuration)
 
     column_data_cursor = state.get("column_data_cursor", None)
     iterative_sync_cursor = state.get("iterative_sync_cursor", None)
 
     submanager_accounts = list(map(lambda z: z.strip(), configuration.get("submanager_account_ids", "").split(",")))
-    submanager_accounts.sort(key=lambda x: int(x))
-    submanager_cursor = state.get("submanager_cursor", submanager_accounts[0])
-    managed_account_cursor = state.get("managed_account_cursor", None)
-    for account in submanager_accounts:
+    submanager_ids = set(submanager_accounts)
+    # A previous sync that stopped part-way left the submanager, the first account
+    # of the batch and the last date it got to. Only that batch resumes from the
+    # date; every other batch starts from the iterative cursor (or full history).
+    resume_submanager = state.get("submanager_cursor", None)
+    resume_account = state.get("managed_account_cursor", None)
+    start_date = iterative_sync_cursor
+    # Every batch queries up to the same day, even if the sync runs past midnight.
+    end_date = datetime.now().date().isoformat()
+    pending_submanagers = accounts_from_cursor(submanager_accounts, resume_submanager)
+    # Discovery for every remaining submanager is fetched up front, concurrently.
+    discovery = get_custom_columns_and_clients(
+        configuration, session, pending_submanagers
+    )
+    for account in pending_submanagers:
+        resuming = account == resume_submanager
+        managed_account_cursor = resume_account if resuming else None
+        resume_date = column_data_cursor if resuming else None
 
         # increment cursor when we get to a new submanager account
-        if managed_account_cursor is None:
-            yield op.checkpoint(
-                {
-                    "submanager_cursor": account,
-                    "iterative_sync_cursor": iterative_sync_cursor,
-                    "column_data_cursor": column_data_cursor,
-                }
-            )
-        else:
-            yield op.checkpoint(
-                {
-                    "submanager_cursor": account,
-                    "managed_account_cursor": managed_account_cursor,
-                    "iterative_sync_cursor": iterative_sync_cursor,
-                    "column_data_cursor": column_data_cursor,
-                }
-            )
-        if int(account) < int(submanager_cursor):
+        submanager_state = {
+            "submanager_cursor": account,
+            "iterative_sync_cursor": iterative_sync_cursor,
+            "column_data_cursor": resume_date,
+        }
+        if managed_account_cursor is not None:
+            submanager_state["managed_account_cursor"] = managed_account_cursor
+        yield op.checkpoint(submanager_state)
+
+        columns, clients = discovery[account]
+        managed_accounts = accounts_from_cursor(
+            filter(lambda z: z not in submanager_ids, clients),
+            managed_account_cursor,
+        )
+        if not managed_accounts:
             continue
 
-        columns = get_custom_columns(configuration, session, account)
-        managed_accounts = list(filter(lambda z: z not in submanager_accounts, get_customer_clients(configuration, session, account)))
-        managed_accounts.sort(key=lambda x: int(x))
-        managed_account_cursor = state.get(
-            "managed_account_cursor", managed_accounts[0]
+        column_fields = ",".join(f"custom_columns.id[{c['id']}]" for c in columns)
+        pending_accounts = managed_accounts if len(columns) > 0 else []
+
+        # Accounts are queried in batches with one customer.id IN (...) query each.
+        # Up to MAX_WORKERS batches are fetched on background threads while
+        # this one is emitted; batches come back in account order so
+        # checkpoints stay resumable from the batch's first account.
+        column_data_by_batch = fetch_concurrently(
+            partial(
+                fetch_batch,
+                configuration,
+                session,
+                account,
+                column_fields,
+                start_date,
+                end_date,
+                {managed_account_cursor: resume_date},
+            ),
+            batch_accounts(pending_accounts),
         )
 
-        for a in managed_accounts:
+        for batch, column_data in column_data_by_batch:
+            a = batch[0]
+            batch_date = resume_date if a == managed_account_cursor else None
 
-            # increment cursor when we get to a new managed account
+            # increment cursor when we get to a new batch of managed accounts
             yield op.checkpoint(
                 {
                     "submanager_cursor": account,
                     "managed_account_cursor": a,
                     "iterative_sync_cursor": iterative_sync_cursor,
-                    "column_data_cursor": column_data_cursor,
+                    "column_data_cursor": batch_date,
                 }
             )
 
-            if int(a) < int(managed_account_cursor):
-                continue
-
-            for column in columns:
-                data = {
-                    "customer_id": a,
-                    "column_id": column["id"],
-                    "description": column.get("description", ""),
-                    "name": column["name"],
-                    "render_type": column["renderType"],
-                    "value_type": column["valueType"],
-                }
-                yield op.upsert(table="custom_columns", data=data)
-
-            if len(columns) > 0:
-                column_fields = ",".join(
-                    [f"custom_columns.id[{i['id']}]" for i in columns]
-                )
-
-                start_date = (
-                    column_data_cursor
-                    if iterative_sync_cursor is None
-                    else iterative_sync_cursor
-                )
-                column_data = get_custom_column_data(
-                    configuration, session, a, column_fields, start_date
-                )
-                if len(column_data) > 0:
-                    results = column_data[0].get("results", [])
-                    column_headers = column_data[0].get("customColumnHeaders", [])
-                    _start_date = None
-                    for i in results:
-                        campaign_id = i["campaign"]["id"]
-                        date = i["segments"]["date"]
-                        custom_columns = i["customColumns"]
-
-                        if _start_date is None:
-                            _start_date = date
-                            yield op.checkpoint(
-                                {
-                                    "submanager_cursor": account,
-                                    "managed_account_cursor": a,
-                                    "iterative_sync_cursor": iterative_sync_cursor,
-                                    "column_data_cursor": date,
-                                }
-                            )
-                        elif get_date_diff(_start_date, date) < 0:
-                            continue
-                        elif get_date_diff(_start_date, date) > 5:
-                            _start_date = date
-                            yield op.checkpoint(
-                                {
-                                    "submanager_cursor": account,
-                                    "managed_account_cursor": a,
-                                    "iterative_sync_cursor": iterative_sync_cursor,
-                                    "column_data_cursor": date,
-                                }
-                            )
-                        for column_value, column in zip(custom_columns, column_headers):
-                            val = column_value.get("doubleValue", None)
-                            column_id = column["id"]
-                            data = {
-                                "column_id": column_id,
-                                "value": val,
-                                "date": date,
-                                "campaign_id": campaign_id,
-                                "customer_id": a,
-                            }
-                            yield op.upsert(table="custom_column_values", data=data)
+            for customer_id in batch:
+                for column in columns:
+                    data = {
+                        "customer_id": customer_id,
+                        "column_id": column["id"],
+                        "description": column.get("description", ""),
+                        "name": column["name"],
+                        "render_type": column["renderType"],
+                        "value_type": column["valueType"],
+                    }
+                    yield op.upsert(table="custom_columns", data=data)
+
+            # Checkpoint after every stream batch. Rows arrive ordered by date, so
+            # resuming from the last date seen re-pulls at most that one day.
+            checkpoint_state = {
+                "submanager_cursor": account,
+                "managed_account_cursor": a,
+                "iterative_sync_cursor": iterative_sync_cursor,
+                "column_data_cursor": None,
+            }
+            # Every batch of one query set has the same customColumnHeaders, so
+            # the ids are taken from the first batch that has results.
+            column_ids = None
+            for stream_batch in column_data:
+                results = stream_batch.get("results")
+                if not results:
+                    continue
+                if column_ids is None:
+                    column_ids = tuple(
+                        c["id"] for c in stream_batch.get("customColumnHeaders", [])
+                    )
+                for i in results:
+                    customer_id = i["customer"]["id"]
+                    campaign_id = i["campaign"]["id"]
+                    date = i["segments"]["date"]
+                    custom_columns = i["customColumns"]
+
+                    # op.upsert converts data into a record before returning, so one
+                    # dict per row is reused and only column_id / value change per column.
+                    data = {
+                        "column_id": None,
+                        "value": None,
+                        "date": date,
+                        "campaign_id": campaign_id,
+                        "customer_id": customer_id,
+                    }
+                    for column_id, column_value in zip(column_ids, custom_columns):
+                        data["column_id"] = column_id
+                        data["value"] = column_value.get("doubleValue")
+                        yield op.upsert(table="custom_column_values", data=data)
+
+                checkpoint_state["column_data_cursor"] = results[-1]["segments"]["date"]
+                yield op.checkpoint(checkpoint_state)
 
     yield op.checkpoint(
         {
-            "iterative_sync_cursor": datetime.now().date().isoformat(),
+            "iterative_sync_cursor": end_date,
         }
     )
 
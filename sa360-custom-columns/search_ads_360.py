@@ -1,6 +1,165 @@
-from datetime import datetime
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
 from dateutil.relativedelta import relativedelta
+import ijson
+import pickle
+import random
+import tempfile
+import threading
+import time
 import requests as rq
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Pooled sessions keyed by (login-customer-id, refresh token), so configurations
+# with different OAuth credentials never share a session; plus one for the OAuth
+# token endpoint.
+_sessions = {}
+_oauth_session = None
+
+# Access tokens keyed by refresh token, as (access_token, expiry epoch seconds).
+# Refreshes are serialized so concurrent workers share one OAuth request.
+_token_cache = {}
+_token_lock = threading.Lock()
+
+# Discovery results keyed by (customer_id, login-customer-id), so the same
+# account isn't re-queried within one update() call. Cleared at the start of
+# every update() (see reset_discovery_caches) and on token refresh.
+_customer_clients_cache = {}
+_custom_columns_cache = {}
+
+# Number of account batches streamed concurrently by fetch_concurrently.
+MAX_WORKERS = 8
+# Number of discovery lookups (custom columns, customer clients) issued at once.
+DISCOVERY_WORKERS = 16
+# Pages (searchStream batches of up to 10000 rows) a fetched batch keeps in memory
+# before the rest is spilled to a temporary file.
+SPILL_AFTER_PAGES = 5
+# Number of customer ids combined into one customer.id IN (...) query.
+CUSTOMER_BATCH_SIZE = 20
+
+# Client-side ceiling on SA360 requests per second across all threads; the
+# limiter backs off from it on 429s and climbs back by RATE_INCREASE per success.
+MAX_QPS = 10
+MIN_QPS = 0.5
+RATE_INCREASE = 0.1
+# Minimum seconds between two rate decreases; 429s from requests that were
+# already in flight when the quota was hit shouldn't halve the rate again.
+RATE_DECREASE_WINDOW = 1.0
+# Longest shared backoff, in seconds, a single 429 (or its Retry-After) can impose.
+BACKOFF_MAX = 600
+
+
+class SA360HTTPError(rq.HTTPError):
+    """Raised by make_sa360_request for any unsuccessful SA360 response."""
+
+
+class SA360AuthError(SA360HTTPError):
+    """Raised when a request is still unauthorized after refreshing the access token."""
+
+
+# Monotonic time before which no SA360 request is sent. Pushed out whenever any
+# thread is rate limited, so concurrent workers back off together.
+_backoff_until = 0.0
+_backoff_lock = threading.Lock()
+
+
+def _extend_backoff(delay: float):
+    global _backoff_until
+    delay = min(max(delay, 0.0), BACKOFF_MAX)
+    with _backoff_lock:
+        _backoff_until = max(_backoff_until, time.monotonic() + delay)
+
+
+def _wait_for_backoff():
+    """
+    Blocks until the shared backoff deadline has passed. Threads that had to
+    wait then sleep a further random 0-1s, so they don't all resume at the
+    same instant and trip the quota again.
+    """
+    waited = False
+    while True:
+        remaining = _backoff_until - time.monotonic()
+        if remaining <= 0:
+            break
+        waited = True
+        time.sleep(remaining)
+    if waited:
+        time.sleep(random.uniform(0, 1))
+
+
+class _RateLimiter:
+    """
+    Thread-safe token bucket shared by every SA360 request, so concurrent
+    workers are shaped to the quota up front instead of discovering it via
+    429s. The rate adapts AIMD-style: halved once per congestion event, then
+    raised by RATE_INCREASE per successful request back up to max_rate.
+    """
+
+    def __init__(self, max_rate: float, min_rate: float = MIN_QPS):
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.rate = max_rate
+        self.tokens = max_rate
+        self.updated = time.monotonic()
+        self.last_decrease = float("-inf")
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                # Capacity never drops below one token, or a rate under 1/s
+                # could never refill enough to let a request through.
+                self.tokens = min(
+                    max(self.rate, 1.0), self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def on_success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + RATE_INCREASE)
+
+    def on_rate_limited(self):
+        with self.lock:
+            now = time.monotonic()
+            # A burst of 429s is one congestion event: ignore the rest until
+            # the shared backoff it triggered has passed.
+            if now < max(self.last_decrease + RATE_DECREASE_WINDOW, _backoff_until):
+                return
+            self.last_decrease = now
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, max(self.rate, 1.0))
+
+
+_rate_limiter = _RateLimiter(MAX_QPS)
+
+
+class _SharedBackoffRetry(Retry):
+    """
+    Retry whose wait after a 429 (Retry-After, else exponential backoff) is
+    shared: it pushes out the module-wide backoff deadline that every request
+    waits for, instead of each worker probing the quota on its own schedule.
+    """
+
+    def sleep(self, response=None):
+        if response is None or response.status != 429:
+            return super().sleep(response)
+        delay = None
+        if self.respect_retry_after_header:
+            delay = self.get_retry_after(response)
+        if delay is None:
+            delay = self.get_backoff_time()
+        _rate_limiter.on_rate_limited()
+        _extend_backoff(delay)
+        _wait_for_backoff()
 
 
 def make_sa360_request(
@@ -13,48 +172,135 @@ def make_sa360_request(
 ):
     """Makes a request to the SA360 API, refreshing token if needed."""
 
+    _ensure_fresh_token(config, session)
+    _wait_for_backoff()
+    _rate_limiter.acquire()
     response = session.request(method, url, **kwargs)
+    if response.ok:
+        _rate_limiter.on_success()
 
-    # If unauthorized, try to refresh token and retry
+    # If unauthorized anyway (e.g. clock skew), refresh the token and retry
     if response.status_code == 401 and max_retries > 0:
-        new_access_token = get_access_token(
-            config["google_client_id"],
-            config["google_client_secret"],
-            config["google_refresh_token"],
-        )
-        session.headers.update({"Authorization": f"Bearer {new_access_token}"})
+        # Hand the connection back to the pool; the body is never read.
+        response.close()
+        _ensure_fresh_token(config, session, _sent_token(response))
+        reset_discovery_caches()
         return make_sa360_request(config, method, url, session, max_retries=0, **kwargs)
 
-    response.raise_for_status()
+    # A fresh token was rejected too, e.g. the refresh token was revoked.
+    if response.status_code == 401:
+        raise SA360AuthError(response.text, response=response)
+
+    try:
+        response.raise_for_status()
+    except rq.HTTPError as e:
+        raise SA360HTTPError(str(e), response=response) from e
     return response
 
 
+def _build_session() -> rq.Session:
+    """
+    Creates a requests.Session whose connection pool is sized for bursts of
+    SA360 calls. Transient 5xx and 429 responses are retried at the adapter
+    level with exponential backoff, waiting for Retry-After when the server
+    sends one. Rate-limit waits are shared across threads (see
+    _SharedBackoffRetry).
+
+    requests only speaks HTTP/1.1, so instead of multiplexing over HTTP/2 each
+    worker thread keeps its own warm keep-alive connection; pool_maxsize is
+    the larger of DISCOVERY_WORKERS and MAX_WORKERS so none of them are
+    discarded and re-handshaken.
+    """
+    retries = _SharedBackoffRetry(
+        total=10,
+        backoff_factor=1,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=frozenset(["GET", "POST"]),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=max(DISCOVERY_WORKERS, MAX_WORKERS),
+        max_retries=retries,
+    )
+    session = rq.Session()
+    session.mount("https://", adapter)
+    return session
+
+
 def get_sa360_session(configuration: dict) -> rq.Session:
     """
     Creates a requests.Session with the initial Access Token and
-    login-customer-id for Search Ads 360.
+    login-customer-id for Search Ads 360. Sessions are cached per
+    login-customer-id and refresh token so repeated schema/update calls reuse
+    warm connections.
     """
-    client_id = configuration["google_client_id"]
-    client_secret = configuration["google_client_secret"]
-    refresh_token = configuration["google_refresh_token"]
     login_customer_id = configuration["google_login_customer_id"]
+    refresh_token = configuration["google_refresh_token"]
+    session_key = (login_customer_id, refresh_token)
+    session = _sessions.get(session_key)
+    if session is not None:
+        _ensure_fresh_token(configuration, session)
+        return session
 
+    client_id = configuration["google_client_id"]
+    client_secret = configuration["google_client_secret"]
     access_token = get_access_token(client_id, client_secret, refresh_token)
 
-    session = rq.Session()
+    session = _build_session()
     session.headers.update(
         {
             "Authorization": f"Bearer {access_token}",
             "login-customer-id": login_customer_id,
         }
     )
+    _sessions[session_key] = session
     return session
 
 
+def _sent_token(response) -> str:
+    """Returns the access token the request behind response was sent with."""
+    authorization = response.request.headers.get("Authorization", "")
+    return authorization[len("Bearer ") :]
+
+
+def _ensure_fresh_token(config: dict, session: rq.Session, rejected_token=None):
+    """
+    Makes sure session carries a cached access token that is more than a
+    minute from expiry, refreshing it under _token_lock otherwise.
+    rejected_token is a token the API answered 401 for; it is dropped from
+    the cache unless another thread has already replaced it.
+    """
+    refresh_token = config["google_refresh_token"]
+    if rejected_token is None:
+        cached = _token_cache.get(refresh_token)
+        if (
+            cached is not None
+            and time.time() < cached[1] - 60
+            and session.headers.get("Authorization") == f"Bearer {cached[0]}"
+        ):
+            return
+
+    with _token_lock:
+        cached = _token_cache.get(refresh_token)
+        if cached is not None and cached[0] == rejected_token:
+            del _token_cache[refresh_token]
+        access_token = get_access_token(
+            config["google_client_id"], config["google_client_secret"], refresh_token
+        )
+        session.headers["Authorization"] = f"Bearer {access_token}"
+
+
 def get_access_token(client_id, client_secret, refresh_token) -> str:
     """
-    Exchanges a refresh token for an access token via OAuth2.
+    Exchanges a refresh token for an access token via OAuth2. Tokens are
+    cached until a minute before they expire.
     """
+    cached = _token_cache.get(refresh_token)
+    if cached is not None and time.time() < cached[1] - 60:
+        return cached[0]
+
     url = "https://oauth2.googleapis.com/token"
     data = {
         "client_id": client_id,
@@ -62,12 +308,30 @@ def get_access_token(client_id, client_secret, refresh_token) -> str:
         "refresh_token": refresh_token,
         "grant_type": "refresh_token",
     }
-    payload = "&".join([f"{key}={val}" for key, val in data.items()])
-    headers = {"Content-Type": "application/x-www-form-urlencoded"}
 
-    response = rq.post(url, data=payload, headers=headers)
+    global _oauth_session
+    if _oauth_session is None:
+        _oauth_session = _build_session()
+
+    # requests form-encodes (and percent-escapes) the dict and sets the Content-Type.
+    response = _oauth_session.post(url, data=data)
     response.raise_for_status()
-    return response.json()["access_token"]
+    json_data = response.json()
+    access_token = json_data["access_token"]
+    _token_cache[refresh_token] = (
+        access_token,
+        time.time() + json_data.get("expires_in", 3300),
+    )
+    return access_token
+
+
+def reset_discovery_caches():
+    """
+    Forgets cached customer clients and custom columns, so accounts or columns
+    added since the last lookup are picked up.
+    """
+    _customer_clients_cache.clear()
+    _custom_columns_cache.clear()
 
 
 def get_customer_clients(config: dict, session: rq.Session, submanager_id=None) -> list:
@@ -81,6 +345,10 @@ def get_customer_clients(config: dict, session: rq.Session, submanager_id=None)
         if submanager_id is not None
         else config["google_login_customer_id"]
     )
+    cache_key = (customer_id, config["google_login_customer_id"])
+    if cache_key in _customer_clients_cache:
+        return _customer_clients_cache[cache_key]
+
     url = f"https://searchads360.googleapis.com/v0/customers/{customer_id}/searchAds360:search"
 
     response = make_sa360_request(
@@ -93,8 +361,7 @@ def get_customer_clients(config: dict, session: rq.Session, submanager_id=None)
 
     json_data = response.json()
     results = [i["customerClient"]["id"] for i in json_data.get("results", [])]
-    if len(results) == 0:
-        return [None]
+    _customer_clients_cache[cache_key] = results
     return results
 
 
@@ -102,6 +369,10 @@ def get_custom_columns(config, session, customer_id):
     """
     Retrieves custom columns for a particular client
     """
+    cache_key = (customer_id, config["google_login_customer_id"])
+    if cache_key in _custom_columns_cache:
+        return _custom_columns_cache[cache_key]
+
     url = (
         f"https://searchads360.googleapis.com/v0/customers/{customer_id}/customColumns"
     )
@@ -111,29 +382,198 @@ def get_custom_columns(config, session, customer_id):
         url=url,
         session=session,
     )
-    response.raise_for_status()
     json_data = response.json()
 
-    return json_data.get("customColumns", [])
+    columns = json_data.get("customColumns", [])
+    _custom_columns_cache[cache_key] = columns
+    return columns
+
+
+def get_custom_columns_and_clients(
+    config, session, customer_ids, max_workers=DISCOVERY_WORKERS
+):
+    """
+    Fetches the custom columns and customer_client ids of every submanager in
+    customer_ids. All of the lookups are independent, so they are issued at
+    once on a thread pool instead of one submanager at a time.
+    Returns a dict of customer_id -> (columns, clients).
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        columns = {
+            c: executor.submit(get_custom_columns, config, session, c)
+            for c in customer_ids
+        }
+        clients = {
+            c: executor.submit(get_customer_clients, config, session, c)
+            for c in customer_ids
+        }
+        return {c: (columns[c].result(), clients[c].result()) for c in customer_ids}
 
 
 def get_custom_column_data(config, session, customer_id, custom_columns, date_cursor):
     """
-    Gets historical data
+    Gets historical data, yielding one searchStream batch at a time
     """
+    return get_custom_column_data_multi(
+        config, session, customer_id, [customer_id], custom_columns, date_cursor
+    )
 
-    url = f"https://searchads360.googleapis.com/v0/customers/{customer_id}/searchAds360:searchStream"
-    start_date = (
-        (datetime.now() - relativedelta(years=2)).date().isoformat()
-        if date_cursor is None
-        else date_cursor
+
+def get_custom_column_data_multi(
+    config, session, manager_id, customer_ids, custom_columns, date_cursor, end_date=None
+):
+    """
+    Gets historical data for several customers under manager_id. Rows carry
+    customer.id so callers can tell them apart.
+
+    end_date (an ISO date string, default today) should be fixed once per
+    sync by the caller so every batch shares the same date window.
+
+    The date range is split into month-sized windows with one searchStream
+    call each, so the first rows arrive quickly and a failure only re-pulls
+    the current window. Each response is parsed incrementally, yielding one
+    stream batch (its results plus customColumnHeaders) at a time rather than
+    loading the whole payload into memory.
+    """
+
+    url = f"https://searchads360.googleapis.com/v0/customers/{manager_id}/searchAds360:searchStream"
+    end_date = (
+        datetime.now().date() if end_date is None else date.fromisoformat(end_date)
     )
-    payload = {
-        "query": f"SELECT campaign.id, segments.date, {custom_columns} FROM campaign WHERE segments.date BETWEEN '{start_date}' AND '{datetime.now().date().isoformat()}' ORDER BY segments.date ASC"
-    }
-    response = make_sa360_request(
-        config, method="POST", url=url, session=session, data=payload
+    window_start = (
+        end_date - relativedelta(years=2)
+        if date_cursor is None
+        else date.fromisoformat(date_cursor)
     )
-    response.raise_for_status()
-    json_data = response.json()
-    return json_data
+    customer_filter = ", ".join(customer_ids)
+    while window_start <= end_date:
+        window_end = min(
+            window_start + relativedelta(months=1) - timedelta(days=1), end_date
+        )
+        payload = {
+            "query": f"SELECT customer.id, campaign.id, segments.date, {custom_columns} FROM campaign WHERE customer.id IN ({customer_filter}) AND segments.date BETWEEN '{window_start.isoformat()}' AND '{window_end.isoformat()}' ORDER BY segments.date ASC"
+        }
+        response = make_sa360_request(
+            config, method="POST", url=url, session=session, data=payload, stream=True
+        )
+        with response:
+            response.raw.decode_content = True
+            yield from ijson.items(response.raw, "item", use_float=True)
+
+        window_start = window_end + timedelta(days=1)
+
+
+def accounts_from_cursor(accounts, cursor=None):
+    """
+    Sorts account ids numerically and returns the ones at or after cursor.
+    The resume point is found with a binary search over the int ids, so
+    already-synced accounts are neither cast nor walked one by one.
+    """
+    pairs = sorted((int(a), a) for a in accounts)
+    start = 0 if cursor is None else bisect_left(pairs, (int(cursor),))
+    return [a for _, a in pairs[start:]]
+
+
+def batch_accounts(accounts, batch_size=CUSTOMER_BATCH_SIZE):
+    """
+    Splits accounts into consecutive lists of at most batch_size, keeping
+    each IN (...) filter well under the SA360 query length limit.
+    """
+    return [accounts[i : i + batch_size] for i in range(0, len(accounts), batch_size)]
+
+
+def _drain(fn, item, stop: threading.Event, spill_after: int):
+    """
+    Runs fn(item) to completion, so its streamed response is read off the
+    socket as fast as it arrives instead of waiting on the consumer. The
+    first spill_after pages are kept in memory; later ones are pickled to a
+    temporary file so a huge batch doesn't have to fit in RAM. Gives up as
+    soon as stop is set. Returns (pages, spill_file or None).
+    """
+    pages = []
+    spill = None
+    values = iter(fn(item))
+    try:
+        for value in values:
+            if stop.is_set():
+                break
+            if len(pages) < spill_after:
+                pages.append(value)
+                continue
+            if spill is None:
+                spill = tempfile.TemporaryFile()
+            pickle.dump(value, spill, protocol=pickle.HIGHEST_PROTOCOL)
+    except BaseException:
+        if spill is not None:
+            spill.close()
+        raise
+    finally:
+        # Closes the underlying response right away when a fetch is abandoned.
+        close = getattr(values, "close", None)
+        if close is not None:
+            close()
+    return pages, spill
+
+
+def _replay(pages, spill):
+    """Yields the pages collected by _drain, in order, closing any spill file."""
+    yield from pages
+    if spill is None:
+        return
+    with spill:
+        spill.seek(0)
+        while True:
+            try:
+                yield pickle.load(spill)
+            except EOFError:
+                return
+
+
+def _discard(future):
+    """Closes the spill file of a fetch that finished but was never consumed."""
+    if future.done() and not future.cancelled() and future.exception() is None:
+        spill = future.result()[1]
+        if spill is not None:
+            spill.close()
+
+
+def fetch_concurrently(
+    fn, items, max_workers=MAX_WORKERS, spill_after=SPILL_AFTER_PAGES
+):
+    """
+    Calls fn(item) for every item on a thread pool, where fn returns an
+    iterable of pages. Yields (item, pages) pairs in the original item order,
+    buffering batches that finish out of order, so callers can emit
+    operations and checkpoints from a single thread.
+
+    fn returns streamed responses, and a stream left half-read while the
+    consumer works through earlier batches would be killed by server or
+    proxy idle timeouts. Each worker therefore drains its stream completely
+    (see _drain), and at most max_workers + 1 batches are fetched or
+    buffered ahead of the consumer at any time.
+    """
+    stop = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending = deque()
+    remaining = iter(items)
+
+    def submit_next():
+        for item in remaining:
+            future = executor.submit(_drain, fn, item, stop, spill_after)
+            pending.append((item, future))
+            return
+
+    try:
+        for _ in range(max_workers + 1):
+            submit_next()
+
+        while pending:
+            item, future = pending.popleft()
+            pages, spill = future.result()
+            submit_next()
+            yield item, _replay(pages, spill)
+    finally:
+        stop.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+        for _, future in pending:
+            _discard(future)
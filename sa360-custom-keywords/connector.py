@@ -1,13 +1,17 @@
 from datetime import datetime
+from functools import partial
 from fivetran_connector_sdk import Connector
 from fivetran_connector_sdk import Logging as log
 from fivetran_connector_sdk import Operations as op
 from search_ads_360 import (
-    generate_custom_column_rows,
+    accounts_from_cursor,
+    batch_accounts,
+    fetch_concurrently,
     get_sa360_session,
-    get_customer_clients,
-    get_custom_columns,
-    get_custom_column_data,
+    get_custom_columns_and_clients,
+    get_custom_column_data_multi,
+    iter_custom_column_rows,
+    reset_discovery_caches,
 )
 
 
@@ -43,16 +47,32 @@ def schema(configuration: dict):
     ]
 
 
-def get_date_diff(date_str_1, date_str_2):
-    fmt = "%Y-%m-%d"
-    d1 = datetime.strptime(date_str_1, fmt)
-    d2 = datetime.strptime(date_str_2, fmt)
-    return (d2 - d1).days
+def fetch_batch(
+    configuration,
+    session,
+    manager_id,
+    custom_columns,
+    start_date,
+    end_date,
+    resume_dates,
+    batch,
+):
+    """
+    Streams the keyword rows of one batch of managed accounts, starting from
+    the date in resume_dates for the batch's first account if a previous sync
+    stopped inside it, and from start_date otherwise.
+    """
+    date_cursor = resume_dates.get(batch[0]) or start_date
+    return get_custom_column_data_multi(
+        configuration, session, manager_id, batch, custom_columns, date_cursor, end_date
+    )
 
 
 # https://fivetran.com/docs/connectors/connector-sdk/technical-reference#update
 def update(configuration: dict, state: dict):
     log.info("Connector started successfully.")
+    # The process may be reused across syncs; re-discover accounts and columns.
+    reset_discovery_caches()
     session = get_sa360_session(configuration)
 
     column_data_cursor = state.get("column_data_cursor", None)
@@ -64,66 +84,78 @@ def update(configuration: dict, state: dict):
             configuration.get("submanager_account_ids", "").split(","),
         )
     )
-    submanager_accounts.sort(key=lambda x: int(x))
-    submanager_cursor = state.get("submanager_cursor", submanager_accounts[0])
-    managed_account_cursor = state.get("managed_account_cursor", None)
-    for account in submanager_accounts:
+    submanager_ids = set(submanager_accounts)
+    # A previous sync that stopped part-way left the submanager, the first account
+    # of the batch and the last date it got to. Only that batch resumes from the
+    # date; every other batch starts from the iterative cursor (or full history).
+    resume_submanager = state.get("submanager_cursor", None)
+    resume_account = state.get("managed_account_cursor", None)
+    start_date = iterative_sync_cursor
+    # Every batch queries up to the same day, even if the sync runs past midnight.
+    end_date = datetime.now().date().isoformat()
+    pending_submanagers = accounts_from_cursor(submanager_accounts, resume_submanager)
+    # Discovery for every remaining submanager is fetched up front, concurrently.
+    discovery = get_custom_columns_and_clients(
+        configuration, session, pending_submanagers
+    )
+    for account in pending_submanagers:
         log.info(f"Beginning sync for submanager {account}")
-        if int(account) < int(submanager_cursor):
-            continue
-
-        columns = get_custom_columns(configuration, session, account)
-        managed_accounts = list(
-            filter(
-                lambda z: z not in submanager_accounts,
-                get_customer_clients(configuration, session, account),
-            )
-        )
-        managed_accounts.sort(key=lambda x: int(x))
-        managed_account_cursor = state.get(
-            "managed_account_cursor", managed_accounts[0]
+        resuming = account == resume_submanager
+        managed_account_cursor = resume_account if resuming else None
+        resume_date = column_data_cursor if resuming else None
+
+        columns, clients = discovery[account]
+        managed_accounts = accounts_from_cursor(
+            filter(lambda z: z not in submanager_ids, clients),
+            managed_account_cursor,
         )
+        if not managed_accounts:
+            continue
 
-        for a in managed_accounts:
-            log.info(f"Beginning sync for account {a}")
-            if int(a) < int(managed_account_cursor):
-                continue
-
-            if len(columns) > 0:
-                column_fields = ",".join(
-                    [f"custom_columns.id[{i['id']}]" for i in columns]
-                )
-
-                start_date = (
-                    column_data_cursor
-                    if iterative_sync_cursor is None
-                    else iterative_sync_cursor
-                )
-                log.info("Beginning fetch")
-                for idx, item in enumerate(
-                    generate_custom_column_rows(
-                        configuration, session, a, column_fields, start_date
+        column_ids = tuple(c["id"] for c in columns)
+        column_fields = ",".join(f"custom_columns.id[{c}]" for c in column_ids)
+        pending_accounts = managed_accounts if len(columns) > 0 else []
+
+        # Accounts are queried in batches with one customer.id IN (...) query each.
+        # Up to MAX_WORKERS batches are streamed on background threads while
+        # this one is emitted; batches come back in account order so rows and
+        # checkpoints are emitted serially.
+        for batch, pages in fetch_concurrently(
+            partial(
+                fetch_batch,
+                configuration,
+                session,
+                account,
+                column_fields,
+                start_date,
+                end_date,
+                {managed_account_cursor: resume_date},
+            ),
+            batch_accounts(pending_accounts),
+        ):
+            a = batch[0]
+            log.info(f"Beginning sync for accounts {', '.join(batch)}")
+            log.info("Beginning fetch")
+            for idx, item in enumerate(iter_custom_column_rows(pages, column_ids)):
+
+                if idx % 10000 == 0:
+                    log.info(f"Processed {idx} records -- {item['date']}")
+                if idx % 50000 == 0 and idx != 0:
+                    log.info(f"Checkpoint at {idx} records -- {item['date']}")
+                    yield op.checkpoint(
+                        {
+                            "submanager_cursor": account,
+                            "managed_account_cursor": a,
+                            "iterative_sync_cursor": iterative_sync_cursor,
+                            "column_data_cursor": item["date"],
+                        }
                     )
-                ):
-
-                    if idx % 10000 == 0:
-                        log.info(f"Processed {idx} records -- {item["date"]}")
-                    if idx % 50000 == 0 and idx != 0:
-                        log.info(f"Checkpoint at {idx} records -- {item["date"]}")
-                        yield op.checkpoint(
-                            {
-                                "submanager_cursor": account,
-                                "managed_account_cursor": a,
-                                "iterative_sync_cursor": iterative_sync_cursor,
-                                "column_data_cursor": item["date"],
-                            }
-                        )
-
-                    yield op.upsert(table="custom_column_metrics", data=item)
+
+                yield op.upsert(table="custom_column_metrics", data=item)
 
     yield op.checkpoint(
         {
-            "iterative_sync_cursor": datetime.now().date().isoformat(),
+            "iterative_sync_cursor": end_date,
         }
     )
 
@@ -0,0 +1,25 @@
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+CONNECTORS = ["sa360-custom-columns", "sa360-custom-keywords"]
+
+
+def load_helper(connector):
+    """
+    Imports a connector's search_ads_360.py under a unique module name. Each
+    connector directory is deployed on its own and ships its own copy.
+    """
+    path = ROOT / connector / "search_ads_360.py"
+    name = "search_ads_360_" + connector.replace("-", "_")
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(params=CONNECTORS)
+def sa360(request):
+    return load_helper(request.param)
@@ -0,0 +1,131 @@
+import threading
+import time
+
+CONFIG = {
+    "google_client_id": "client",
+    "google_client_secret": "secret",
+    "google_refresh_token": "refresh",
+    "google_login_customer_id": "1",
+}
+
+
+class FakeOAuthSession:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.posts = 0
+
+    def post(self, url, data):
+        with self.lock:
+            self.posts += 1
+            token = f"new{self.posts}"
+        time.sleep(0.05)
+        return FakeResponse(200, json={"access_token": token, "expires_in": 3599})
+
+
+class FakeRequest:
+    def __init__(self, headers):
+        self.headers = dict(headers)
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None, json=None):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.text = ""
+        self.request = FakeRequest(headers or {})
+        self._json = json
+        self.closed = False
+
+    def json(self):
+        return self._json
+
+    def raise_for_status(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSession:
+    """Answers 401 for any token other than the ones the fake OAuth issued."""
+
+    def __init__(self, barrier=None):
+        self.headers = {}
+        self.barrier = barrier
+        self.sent = []
+        self.responses = []
+
+    def request(self, method, url, **kwargs):
+        headers = dict(self.headers)
+        self.sent.append(headers.get("Authorization"))
+        if not headers.get("Authorization", "").startswith("Bearer new"):
+            if self.barrier is not None:
+                self.barrier.wait(5)
+            response = FakeResponse(401, headers)
+        else:
+            response = FakeResponse(200, headers)
+        self.responses.append(response)
+        return response
+
+
+def test_near_expiry_token_is_refreshed_before_the_request(sa360):
+    oauth = sa360._oauth_session = FakeOAuthSession()
+    sa360._token_cache["refresh"] = ("old", time.time() + 30)
+    session = FakeSession()
+    session.headers["Authorization"] = "Bearer old"
+
+    response = sa360.make_sa360_request(CONFIG, "GET", "https://x", session)
+
+    assert response.status_code == 200
+    assert session.sent == ["Bearer new1"]
+    assert oauth.posts == 1
+
+
+def test_concurrent_401s_share_one_refresh(sa360):
+    oauth = sa360._oauth_session = FakeOAuthSession()
+    # Still valid locally, but rejected by the API (e.g. clock skew).
+    sa360._token_cache["refresh"] = ("old", time.time() + 3000)
+    workers = 8
+    session = FakeSession(threading.Barrier(workers))
+    session.headers["Authorization"] = "Bearer old"
+    statuses = []
+
+    def call():
+        response = sa360.make_sa360_request(CONFIG, "GET", "https://x", session)
+        statuses.append(response.status_code)
+
+    threads = [threading.Thread(target=call) for _ in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(10)
+
+    assert statuses == [200] * workers
+    assert oauth.posts == 1
+
+
+def test_rejected_response_is_closed_before_retrying(sa360):
+    sa360._oauth_session = FakeOAuthSession()
+    sa360._token_cache["refresh"] = ("old", time.time() + 3000)
+    session = FakeSession()
+    session.headers["Authorization"] = "Bearer old"
+
+    response = sa360.make_sa360_request(CONFIG, "GET", "https://x", session)
+
+    assert response.status_code == 200
+    rejected, retried = session.responses
+    assert rejected.closed
+    assert not retried.closed
+
+
+def test_sessions_are_not_shared_across_credentials(sa360):
+    sa360._oauth_session = FakeOAuthSession()
+    sa360._build_session = FakeSession
+    rotated = dict(CONFIG, google_refresh_token="rotated")
+
+    first = sa360.get_sa360_session(CONFIG)
+    assert sa360.get_sa360_session(CONFIG) is first
+    second = sa360.get_sa360_session(rotated)
+
+    assert second is not first
+    assert second.headers["Authorization"] != first.headers["Authorization"]
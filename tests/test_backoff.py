@@ -0,0 +1,21 @@
+import time
+
+
+def test_backoff_is_clamped_to_backoff_max(sa360):
+    sa360._extend_backoff(10 ** 6)
+    assert sa360._backoff_until - time.monotonic() <= sa360.BACKOFF_MAX
+
+
+def test_no_jitter_when_not_backing_off(sa360, monkeypatch):
+    monkeypatch.setattr(sa360.random, "uniform", lambda a, b: 5)
+    start = time.monotonic()
+    sa360._wait_for_backoff()
+    assert time.monotonic() - start < 1
+
+
+def test_waiters_are_jittered_after_the_deadline(sa360, monkeypatch):
+    monkeypatch.setattr(sa360.random, "uniform", lambda a, b: 0.3)
+    sa360._extend_backoff(0.1)
+    start = time.monotonic()
+    sa360._wait_for_backoff()
+    assert time.monotonic() - start >= 0.4
@@ -0,0 +1,112 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+
+def test_yields_items_in_order(sa360):
+    def pages(n):
+        return [f"{n}-{i}" for i in range(5)]
+
+    result = [
+        (item, list(values))
+        for item, values in sa360.fetch_concurrently(pages, [3, 1, 2])
+    ]
+    assert result == [(3, pages(3)), (1, pages(1)), (2, pages(2))]
+
+
+def test_reraises_worker_exception(sa360):
+    def pages(n):
+        yield n
+        if n == 2:
+            raise ValueError("boom")
+        yield n
+
+    fetched = sa360.fetch_concurrently(pages, [1, 2, 3])
+    item, values = next(fetched)
+    assert list(values) == [1, 1]
+    with pytest.raises(ValueError, match="boom"):
+        next(fetched)
+
+
+def test_reraises_exception_raised_by_fn_call(sa360):
+    def pages(n):
+        raise ValueError("no stream")
+
+    with pytest.raises(ValueError, match="no stream"):
+        next(sa360.fetch_concurrently(pages, [1]))
+
+
+def test_fetches_in_parallel_with_bounded_lookahead(sa360):
+    started = []
+    lock = threading.Lock()
+    release = threading.Event()
+
+    def pages(n):
+        with lock:
+            started.append(n)
+        if n == 1:
+            assert release.wait(5)
+        return [n]
+
+    fetched = sa360.fetch_concurrently(pages, range(1, 11), max_workers=3)
+
+    def consume():
+        return [(item, list(values)) for item, values in fetched]
+
+    reader = ThreadPoolExecutor(max_workers=1).submit(consume)
+    time.sleep(0.2)
+    # Item 1 blocks the consumer, but later items keep loading, up to
+    # max_workers + 1 batches ahead.
+    with lock:
+        assert sorted(started) == [1, 2, 3, 4]
+    release.set()
+    assert reader.result(5) == [(n, [n]) for n in range(1, 11)]
+
+
+def test_drains_streams_before_they_are_consumed(sa360):
+    drained = threading.Event()
+
+    def pages(n):
+        yield from range(3)
+        drained.set()
+
+    fetched = sa360.fetch_concurrently(pages, [1])
+    item, values = next(fetched)
+    assert drained.is_set()
+    assert list(values) == [0, 1, 2]
+
+
+def test_spills_large_batches_to_disk(sa360):
+    def pages(n):
+        return [{"page": i} for i in range(10)]
+
+    result = [
+        list(values)
+        for item, values in sa360.fetch_concurrently(pages, [1, 2], spill_after=3)
+    ]
+    assert result == [pages(1), pages(2)]
+
+
+def test_early_close_stops_workers_and_closes_streams(sa360):
+    closed = threading.Event()
+    started = []
+
+    def pages(n):
+        started.append(n)
+        try:
+            for i in range(100):
+                if n > 1:
+                    time.sleep(0.01)
+                yield i
+        finally:
+            closed.set()
+
+    fetched = sa360.fetch_concurrently(pages, range(1, 100), max_workers=2)
+    item, values = next(fetched)
+    assert next(values) == 0
+    fetched.close()
+
+    assert closed.wait(5)
+    assert len(started) <= 3
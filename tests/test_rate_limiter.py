@@ -0,0 +1,45 @@
+import threading
+
+
+def test_acquire_returns_below_one_qps(sa360):
+    limiter = sa360._RateLimiter(10, min_rate=0.5)
+    for _ in range(5):
+        limiter.last_decrease = float("-inf")
+        limiter.on_rate_limited()
+    assert limiter.rate < 1
+
+    done = threading.Event()
+
+    def take_two():
+        limiter.acquire()
+        limiter.acquire()
+        done.set()
+
+    threading.Thread(target=take_two, daemon=True).start()
+    # The second token takes at most 1 / 0.5 = 2s to refill.
+    assert done.wait(5)
+
+
+def test_rate_recovers_on_success(sa360):
+    limiter = sa360._RateLimiter(4, min_rate=0.5)
+    limiter.on_rate_limited()
+    assert limiter.rate == 2
+    for _ in range(100):
+        limiter.on_success()
+    assert limiter.rate == 4
+
+
+def test_burst_of_429s_halves_rate_once(sa360):
+    limiter = sa360._RateLimiter(8, min_rate=0.5)
+    for _ in range(10):
+        limiter.on_rate_limited()
+    assert limiter.rate == 4
+
+
+def test_no_decrease_during_shared_backoff(sa360):
+    limiter = sa360._RateLimiter(8, min_rate=0.5)
+    limiter.on_rate_limited()
+    limiter.last_decrease = float("-inf")
+    sa360._extend_backoff(30)
+    limiter.on_rate_limited()
+    assert limiter.rate == 4